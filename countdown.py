@@ -3,146 +3,180 @@ from icalendar import Calendar
 from datetime import datetime, date, timedelta
 import sys
 import csv
+import functools
+import io
 import os
+from collections import namedtuple
 from dotenv import load_dotenv
 
-def calculate_days_remaining(event_start, subtract_days=0):
-    today = date.today()
-    adjusted_today = today + timedelta(days=subtract_days)
-    if isinstance(event_start, datetime):
-        start_date = event_start.date()
-    else:
-        start_date = event_start
-    time_difference = start_date - adjusted_today
-    return time_difference.days
+from tripit_io import cached_get, drop_cached
 
-def format_date_asana(dt_object):
-    if isinstance(dt_object, datetime) or isinstance(dt_object, date):
-        return dt_object.strftime("%Y-%m-%d")
-    return ""
+# The VEVENT fields every renderer needs, pulled out of the component once.
+# location is None when the event has no LOCATION (an empty LOCATION stays
+# ''). start_date is the date part of start (date.max when start isn't a
+# date) and is the sort key.
+Ev = namedtuple('Ev', 'name start end location url start_date')
 
-def parse_ical_to_asana_csv(ical_url, report_due_offset=0):
+def _extract(event):
+    start = event.get('DTSTART').dt
+    end = event.get('DTEND')
+    if isinstance(start, datetime):
+        start_date = start.date()
+    elif isinstance(start, date):
+        start_date = start
+    else:
+        start_date = date.max  # Undated events sort last and always count as upcoming
+    return Ev(
+        name=event.get('SUMMARY', '').replace("PLACEHOLDER ONLY:", "").strip(),
+        start=start,
+        end=end.dt if end is not None else None,
+        location=event.get('LOCATION'),
+        url=event.get('URL', '') or '',
+        start_date=start_date,
+    )
+
+def _load_events(ical_url):
+    """Fetches and parses the feed once, returning its events as Ev tuples sorted by start date."""
     try:
-        response = requests.get(ical_url)
-        response.raise_for_status()
-        cal = Calendar.from_ical(response.content)
-        asana_csv_data = [["Task ID", "Created At", "Completed At", "Last Modified", "Name", "Section/Column", "Assignee", "Assignee Email", "Start Date", "Due Date", "Tags", "Notes", "Projects", "Parent task", "Blocked By (Dependencies)", "Blocking (Dependencies)", "Responsible (Department)", "Expected Cost", "Complete By"]] # Asana CSV Header
-
-        for event in cal.walk('VEVENT'):
-            name = event.get('SUMMARY', '').replace("PLACEHOLDER ONLY:", "").strip()
-            start = event.get('DTSTART').dt
-            end = event.get('DTEND').dt
-            location = event.get('LOCATION', '')
-            url = event.get('URL', '')
-
-            start_date_str = format_date_asana(start)
-            due_date_str = format_date_asana(end)
-            notes = location
-            if url:
-                if notes:
-                    notes += f" | {url}"
-                else:
-                    notes = url
-
-            days_remaining = calculate_days_remaining(start, report_due_offset)
-            if days_remaining >= 0:
-                asana_csv_data.append([
-                    "",  # Task ID
-                    format_date_asana(datetime.now().date()),  # Created At (using current date)
-                    "",  # Completed At
-                    format_date_asana(datetime.now().date()),  # Last Modified (using current date)
-                    name,  # Name
-                    "",  # Section/Column
-                    "",  # Assignee
-                    "",  # Assignee Email
-                    start_date_str,  # Start Date
-                    due_date_str,  # Due Date
-                    "",  # Tags
-                    notes,  # Notes
-                    "",  # Projects
-                    "",  # Parent task
-                    "",  # Blocked By (Dependencies)
-                    "",  # Blocking (Dependencies)
-                    "",  # Responsible (Department)
-                    "",  # Expected Cost
-                    start_date_str  # Complete By (using Due Date)
-                ])
-
-        return asana_csv_data
+        cal = Calendar.from_ical(cached_get(ical_url))
+    except Exception:
+        # Don't let a body that doesn't parse be served again on the next 304.
+        drop_cached(ical_url)
+        raise
+    return sorted(map(_extract, cal.walk('VEVENT')), key=lambda ev: ev.start_date)
+
+def _upcoming(events, adjusted_today):
+    """Returns the tail of the sorted events that starts on or after adjusted_today."""
+    # Binary search so only O(log N) start dates are looked at.
+    lo, hi = 0, len(events)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if events[mid].start_date < adjusted_today:
+            lo = mid + 1
+        else:
+            hi = mid
+    return events[lo:]
 
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching iCal data: {e}"
-    except Exception as e:
-        return f"An error occurred: {e}"
+def _buffered_stdout(buffer_size=65536):
+    """Returns a text stream over stdout that batches writes into buffer_size chunks."""
+    sys.stdout.flush()
+    raw = io.open(sys.stdout.fileno(), "wb", buffering=buffer_size, closefd=False)
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="", line_buffering=False, write_through=False)
 
-def parse_ical_to_csv(ical_url, report_due_offset=0):
-    try:
-        response = requests.get(ical_url)
-        response.raise_for_status()
-        cal = Calendar.from_ical(response.content)
-        csv_data = [["Task", "Due Date", "Notes"]]  # Basic CSV Header
-
-        for event in cal.walk('VEVENT'):
-            name = event.get('SUMMARY', '').replace("PLACEHOLDER ONLY:", "").strip()
-            start = event.get('DTSTART').dt
-            end = event.get('DTEND').dt
-            location = event.get('LOCATION', '')
-            url = event.get('URL', '')
-
-            due_date_str = format_date_asana(end)
-            notes = location
-            if url:
-                if notes:
-                    notes += f" | {url}"
-                else:
-                    notes = url
+def _adjusted_today(report_due_offset=0):
+    return date.today() + timedelta(days=report_due_offset)
 
-            days_remaining = calculate_days_remaining(start, report_due_offset)
-            if days_remaining >= 0:
-                csv_data.append([
-                    name,  # Task
-                    due_date_str,  # Due Date
-                    notes  # Notes
-                ])
+def _days_until(event_start, adjusted_today):
+    """Days from adjusted_today (see _adjusted_today) until event_start."""
+    start_date = event_start.date() if isinstance(event_start, datetime) else event_start
+    return (start_date - adjusted_today).days
 
-        return csv_data
+def _format_notes(location, url):
+    """Joins location and URL into the Notes column, skipping whichever is empty."""
+    if location and url:
+        return f"{location} | {url}"
+    return location or url
 
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching iCal data: {e}"
-    except Exception as e:
-        return f"An error occurred: {e}"
+def format_date_asana(dt_object):
+    if isinstance(dt_object, date):
+        return f"{dt_object.year:04d}-{dt_object.month:02d}-{dt_object.day:02d}"
+    return ""
 
-def calculate_days_remaining_general(event_start, subtract_days=0):
-    today = date.today()
-    adjusted_today = today + timedelta(days=subtract_days)
-    if isinstance(event_start, datetime):
-        start_date = event_start.date()
-    else:
-        start_date = event_start
-    time_difference = start_date - adjusted_today
-    return time_difference.days
+ASANA_CSV_HEADER = ["Task ID", "Created At", "Completed At", "Last Modified", "Name", "Section/Column", "Assignee", "Assignee Email", "Start Date", "Due Date", "Tags", "Notes", "Projects", "Parent task", "Blocked By (Dependencies)", "Blocking (Dependencies)", "Responsible (Department)", "Expected Cost", "Complete By"]
+CSV_HEADER = ["Task", "Due Date", "Notes"]
+
+def iter_ical_asana_csv_rows(events, report_due_offset=0):
+    """Yields one Asana CSV row (without the header) per upcoming event."""
+    adjusted_today = _adjusted_today(report_due_offset)
+    today_str = date.today().isoformat()
+
+    for event in _upcoming(events, adjusted_today):
+        start_date_str = format_date_asana(event.start)
+        due_date_str = format_date_asana(event.end)
+        notes = _format_notes(event.location, event.url)
+
+        yield [
+            "",  # Task ID
+            today_str,  # Created At (using current date)
+            "",  # Completed At
+            today_str,  # Last Modified (using current date)
+            event.name,  # Name
+            "",  # Section/Column
+            "",  # Assignee
+            "",  # Assignee Email
+            start_date_str,  # Start Date
+            due_date_str,  # Due Date
+            "",  # Tags
+            notes,  # Notes
+            "",  # Projects
+            "",  # Parent task
+            "",  # Blocked By (Dependencies)
+            "",  # Blocking (Dependencies)
+            "",  # Responsible (Department)
+            "",  # Expected Cost
+            start_date_str  # Complete By (using Due Date)
+        ]
+
+def write_asana_csv(events, out_stream, report_due_offset=0):
+    """Writes the Asana CSV (header plus one row per upcoming event) to out_stream."""
+    writer = csv.writer(out_stream)
+    writer.writerow(ASANA_CSV_HEADER)
+    writer.writerows(iter_ical_asana_csv_rows(events, report_due_offset))
+
+def iter_ical_csv_rows(events, report_due_offset=0):
+    """Yields one basic CSV row (without the header) per upcoming event."""
+    adjusted_today = _adjusted_today(report_due_offset)
+
+    for event in _upcoming(events, adjusted_today):
+        due_date_str = format_date_asana(event.end)
+        notes = _format_notes(event.location, event.url)
+
+        yield [
+            event.name,  # Task
+            due_date_str,  # Due Date
+            notes  # Notes
+        ]
+
+def write_csv(events, out_stream, report_due_offset=0):
+    """Writes the basic CSV (header plus one row per upcoming event) to out_stream."""
+    writer = csv.writer(out_stream)
+    writer.writerow(CSV_HEADER)
+    writer.writerows(iter_ical_csv_rows(events, report_due_offset))
+
+# strftime is slow and the same few trip dates get formatted over and over,
+# so the formatters below are memoized on the date's ordinal.
+@functools.lru_cache(maxsize=4096)
+def _fmt_month_day(ordinal):
+    return date.fromordinal(ordinal).strftime("%B %d")
+
+@functools.lru_cache(maxsize=4096)
+def _fmt_month_day_year(ordinal):
+    return date.fromordinal(ordinal).strftime("%B %d, %Y")
+
+@functools.lru_cache(maxsize=4096)
+def _fmt_short_month_day(ordinal):
+    return date.fromordinal(ordinal).strftime("%b %d")
 
 def format_date_general(dt_object):
-    if isinstance(dt_object, datetime) or isinstance(dt_object, date):
-        return dt_object.strftime("%B %d")
+    if isinstance(dt_object, date):
+        return _fmt_month_day(dt_object.toordinal())
     return "Unknown"
 
 def format_date_with_year_general(dt_object):
-    if isinstance(dt_object, datetime) or isinstance(dt_object, date):
-        return dt_object.strftime("%B %d, %Y")
+    if isinstance(dt_object, date):
+        return _fmt_month_day_year(dt_object.toordinal())
     return "Unknown"
 
-def format_summary_countdown_general(event, plain_text=False, show_dates=False, report_due_offset=0):
-    summary = event.get('SUMMARY', '').replace("PLACEHOLDER ONLY:", "").strip()
-    location = event.get('LOCATION', 'No Location Specified')
-    start = event.get('DTSTART').dt
-    end = event.get('DTEND').dt
+def format_summary_countdown_general(event, adjusted_today, plain_text=False, show_dates=False):
+    summary = event.name
+    location = event.location if event.location is not None else 'No Location Specified'
+    start = event.start
 
     start_date_str = format_date_general(start)
-    end_date_str = format_date_with_year_general(end)
+    end_date_str = format_date_with_year_general(event.end)
 
-    if isinstance(start, datetime) or isinstance(start, date):
-        days_remaining = calculate_days_remaining_general(start, report_due_offset)
+    if isinstance(start, date):
+        days_remaining = _days_until(start, adjusted_today)
         date_info = f" ({start_date_str} to {end_date_str})" if show_dates else ""
         if days_remaining >= 0:
             if plain_text:
@@ -158,14 +192,14 @@ def format_summary_countdown_general(event, plain_text=False, show_dates=False,
             return f"- **{summary}** - {location} (Date/Time Unknown)\n"
 
 
-def format_summary_business(event, report_due_offset=0):
+def format_summary_business(event, adjusted_today):
     """Business-style formatting: "Week of Month DD, YYYY: City (Event title)"""
-    summary = event.get('SUMMARY', '').replace("PLACEHOLDER ONLY:", "").strip()
-    location = event.get('LOCATION', '')
-    start = event.get('DTSTART').dt
+    summary = event.name
+    location = event.location
+    start = event.start
 
-    if isinstance(start, datetime) or isinstance(start, date):
-        days_remaining = calculate_days_remaining_general(start, report_due_offset)
+    if isinstance(start, date):
+        days_remaining = _days_until(start, adjusted_today)
         if days_remaining < 0:
             return None
         # Use full date with year for the "Week of" label
@@ -175,69 +209,51 @@ def format_summary_business(event, report_due_offset=0):
         return f"Week of {start_with_year}: {city} ({summary})\n"
     return None
 
-def format_summary_updates(event):
-    summary = event.get('SUMMARY', '').replace("PLACEHOLDER ONLY:", "").strip()
-    location = event.get('LOCATION', 'No Location Specified')
-    start = event.get('DTSTART').dt
+def format_summary_updates(event, adjusted_today):
+    summary = event.name
+    location = event.location if event.location is not None else 'No Location Specified'
+    start = event.start
 
-    if isinstance(start, datetime) or isinstance(start, date):
-        days_remaining = calculate_days_remaining_general(start, 0)
+    if isinstance(start, date):
+        days_remaining = _days_until(start, adjusted_today)
         if days_remaining >= 0:
-            date_str = start.strftime("%b %d")
+            date_str = _fmt_short_month_day(start.toordinal())
             return f"- {summary} in {location} ({date_str})\n"
         else:
             return None
     else:
         return f"- {summary} in {location} (Date Unknown)\n"
 
-def parse_ical_to_updates(ical_url):
-    try:
-        response = requests.get(ical_url)
-        response.raise_for_status()
-        cal = Calendar.from_ical(response.content)
-        updates_output = ""
-        upcoming_events = False
+def _render_updates(events):
+    adjusted_today = _adjusted_today()
+    parts = []
 
-        for event in cal.walk('VEVENT'):
-            formatted_summary = format_summary_updates(event)
-            if formatted_summary:
-                updates_output += formatted_summary
-                upcoming_events = True
+    for event in _upcoming(events, adjusted_today):
+        formatted_summary = format_summary_updates(event, adjusted_today)
+        if formatted_summary:
+            parts.append(formatted_summary)
 
-        if not upcoming_events:
-            updates_output += "No upcoming events found.\n"
+    if not parts:
+        parts.append("No upcoming events found.\n")
 
-        return updates_output
+    return ''.join(parts)
 
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching iCal data: {e}"
-    except Exception as e:
-        return f"An error occurred: {e}"
-
-def parse_ical_to_summary_countdown(ical_url, plain_text=False, show_dates=False, report_due_offset=0, business=False):
-    try:
-        response = requests.get(ical_url)
-        response.raise_for_status()
-        cal = Calendar.from_ical(response.content)
-        output = ""
-
-        for event in cal.walk('VEVENT'):
-            if business:
-                formatted = format_summary_business(event, report_due_offset)
-            else:
-                formatted = format_summary_countdown_general(event, plain_text, show_dates, report_due_offset)
-            if formatted:
-                output += formatted
+def _render_summary_countdown(events, plain_text=False, show_dates=False, report_due_offset=0, business=False):
+    adjusted_today = _adjusted_today(report_due_offset)
+    parts = []
 
-        if not output:
-            output = "No upcoming events found.\n"
+    for event in _upcoming(events, adjusted_today):
+        if business:
+            formatted = format_summary_business(event, adjusted_today)
+        else:
+            formatted = format_summary_countdown_general(event, adjusted_today, plain_text, show_dates)
+        if formatted:
+            parts.append(formatted)
 
-        return output
+    if not parts:
+        return "No upcoming events found.\n"
 
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching iCal data: {e}"
-    except Exception as e:
-        return f"An error occurred: {e}"
+    return ''.join(parts)
 
 if __name__ == "__main__":
     load_dotenv()
@@ -294,27 +310,29 @@ if __name__ == "__main__":
         print("  --business          Output in business format: Week of Month DD, YYYY: City (Event title)")
         sys.exit(1)
 
-    if ical_url:
-        if output_format == "csv":
-            csv_data = parse_ical_to_csv(ical_url, report_due_offset)
-            if isinstance(csv_data, str):
-                print(csv_data)
-            else:
-                writer = csv.writer(sys.stdout)
-                writer.writerows(csv_data)
-        elif output_format == "asana_csv":
-            asana_csv_data = parse_ical_to_asana_csv(ical_url, report_due_offset)
-            if isinstance(asana_csv_data, str):
-                print(asana_csv_data)
-            else:
-                writer = csv.writer(sys.stdout)
-                writer.writerows(asana_csv_data)
+    try:
+        events = _load_events(ical_url)
+        if output_format in ("csv", "asana_csv"):
+            out = _buffered_stdout()
+            try:
+                if output_format == "csv":
+                    write_csv(events, out, report_due_offset)
+                else:
+                    write_asana_csv(events, out, report_due_offset)
+                out.flush()
+            except BrokenPipeError:
+                # The reader went away (e.g. piped into head). Point stdout at
+                # devnull so the interpreter's final flush can't fail again.
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+                sys.exit(1)
         elif output_format == "updates":
-            updates_output = parse_ical_to_updates(ical_url)
-            print(updates_output)
+            print(_render_updates(events))
         else:
-            if business_output:
-                summary_output = parse_ical_to_summary_countdown(ical_url, plain_text_output, show_dates_output, report_due_offset, business=True)
-            else:
-                summary_output = parse_ical_to_summary_countdown(ical_url, plain_text_output, show_dates_output, report_due_offset)
-            print(summary_output)
+            print(_render_summary_countdown(events, plain_text_output, show_dates_output, report_due_offset, business=business_output))
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching iCal data: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
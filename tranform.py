@@ -4,35 +4,45 @@ import os
 import sys
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import icalendar
-import pytz
 import requests
 
+from tripit_io import cached_get, drop_cached, write_atomic
+
 # --- Configuration ---
 # Set up basic logging. We'll use this for final status messages.
 # The spinner will handle intermediate "in-progress" messages.
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
+UTC = timezone.utc
+
 # --- Fun Animation Class ---
 class Spinner:
-    """A context manager to display a spinner animation in the terminal."""
+    """
+    A context manager to display a spinner animation in the terminal.
 
-    def __init__(self, message="Working...", delay=0.1):
+    The spinner thread competes with the main thread for the GIL, and parsing
+    the calendar is pure Python, so every frame slows the real work down a
+    little. It therefore only runs on a TTY and redraws at a modest rate.
+    """
+
+    def __init__(self, message="Working...", delay=0.2, enabled=True):
         """
         Initializes the Spinner.
 
         Args:
             message (str): The message to display next to the spinner.
             delay (float): The speed of the animation.
+            enabled (bool): Set to False to make the spinner a no-op.
         """
         self.spinner = threading.Thread(target=self._spin)
         self.message = message
         self.delay = delay
         self.running = False
-        # Get the current cursor visibility setting to restore it later
-        self._cursor_visible = not os.system('tput civis') == 0
+        # Only animate on a terminal; piped or redirected output gets no spinner.
+        self.enabled = enabled and sys.stdout.isatty()
 
     def _spin(self):
         """The target function for the animation thread."""
@@ -48,21 +58,23 @@ class Spinner:
 
     def start(self):
         """Starts the spinner animation."""
+        if not self.enabled:
+            return
         self.running = True
         # Hide the cursor for a cleaner look
-        os.system('tput civis')
+        sys.stdout.write("\033[?25l")
+        sys.stdout.flush()
         self.spinner.start()
 
     def stop(self):
         """Stops the spinner animation and cleans up the line."""
+        if not self.running:
+            return
         self.running = False
         self.spinner.join()
-        # Clear the line by writing spaces over it
-        sys.stdout.write("\r" + " " * (len(self.message) + 2) + "\r")
+        # Clear the line by writing spaces over it, then restore the cursor
+        sys.stdout.write("\r" + " " * (len(self.message) + 2) + "\r\033[?25h")
         sys.stdout.flush()
-        # Restore cursor visibility
-        if self._cursor_visible:
-            os.system('tput cnorm')
 
     def __enter__(self):
         """Starts the spinner when entering the 'with' block."""
@@ -94,11 +106,11 @@ class CalendarTransformer:
         Returns:
             A timezone-aware datetime object in UTC.
         """
-        if isinstance(dt, datetime):
-            if dt.tzinfo is None:
-                return pytz.UTC.localize(dt)
-            return dt.astimezone(pytz.UTC)
-        return dt
+        if not isinstance(dt, datetime):
+            return dt
+        if dt.tzinfo is None:
+            return dt.replace(tzinfo=UTC)
+        return dt.astimezone(UTC)
 
     def _transform_event(self, original_event):
         """
@@ -134,19 +146,16 @@ class CalendarTransformer:
         Args:
             ics_content: A string containing the raw iCalendar data.
         Returns:
-            A string containing the transformed iCalendar data.
+            The transformed iCalendar data as UTF-8 encoded bytes.
         """
         try:
             calendar = icalendar.Calendar.from_ical(ics_content)
             new_calendar = icalendar.Calendar()
             new_calendar.add('prodid', '-//Calendar Transformation Script//EN')
             new_calendar.add('version', '2.0')
-            for component in calendar.walk():
-                if component.name == "VEVENT":
-                    transformed_event = self._transform_event(component)
-                    if transformed_event:
-                        new_calendar.add_component(transformed_event)
-            return new_calendar.to_ical().decode('utf-8')
+            for component in calendar.walk('VEVENT'):
+                new_calendar.add_component(self._transform_event(component))
+            return new_calendar.to_ical()
         except Exception as e:
             self.logger.error(f"Failed during calendar transformation: {e}")
             raise
@@ -165,33 +174,48 @@ def main():
         default="correct.ics",
         help="The path to save the final .ics file. Defaults to 'correct.ics'."
     )
+    parser.add_argument(
+        "--no-spinner",
+        action="store_true",
+        help="Don't show the progress spinner."
+    )
+    parser.add_argument(
+        "-q", "--quiet",
+        action="store_true",
+        help="Only log warnings and errors. Implies --no-spinner."
+    )
     args = parser.parse_args()
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    show_spinner = not (args.no_spinner or args.quiet)
     tripit_url = args.tripit_url
     output_filename = args.output_path
 
     try:
         # 1. Fetch the calendar data with a spinner animation.
-        response = None
-        with Spinner(f"Fetching calendar from TripIt..."):
-            headers = {'User-Agent': 'Python-Calendar-Transformer/1.0'}
-            response = requests.get(tripit_url, timeout=30, headers=headers)
-        
-        response.raise_for_status()
+        ics_content = None
+        with Spinner("Fetching calendar from TripIt...", enabled=show_spinner):
+            ics_content = cached_get(tripit_url, timeout=30)
+
         logging.info("Successfully fetched calendar data.")
 
         # 2. Transform the calendar with a spinner animation.
         transformer = CalendarTransformer()
         transformed_content = None
-        with Spinner("Transforming calendar for Outlook compatibility..."):
-            transformed_content = transformer.transform_for_outlook(response.content)
+        with Spinner("Transforming calendar for Outlook compatibility...", enabled=show_spinner):
+            try:
+                transformed_content = transformer.transform_for_outlook(ics_content)
+            except Exception:
+                # Don't let a body that doesn't parse be served again on the next 304.
+                drop_cached(tripit_url)
+                raise
         logging.info("Transformation complete.")
 
         # 3. Save the new calendar to a file.
         output_dir = os.path.dirname(output_filename)
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
-        with open(output_filename, "w", encoding="utf-8") as f:
-            f.write(transformed_content)
+        write_atomic(output_filename, transformed_content)
         logging.info(f"Successfully saved transformed calendar to {output_filename}")
 
     except requests.RequestException as e:
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+# Conditional-GET cache for the TripIt feed. Each URL gets a .body file with the
+# raw iCal bytes and a .meta file with the validators the server sent back.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "parse-tripit")
+
+
+# One pooled, keep-alive session for every fetch. ACCEPT_ENCODING is
+# "gzip,deflate" plus "br" only when a brotli decoder is installed, so we never
+# ask for an encoding urllib3 can't decode.
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "Accept-Encoding": ACCEPT_ENCODING,
+    "User-Agent": "Python-Calendar-Transformer/1.0",
+})
+_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
+
+def _cache_paths(url):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = os.path.join(CACHE_DIR, key)
+    return base + ".body", base + ".meta"
+
+
+def _default_mode(path):
+    """The mode a plain open(path, "w") would leave: the existing file's, else 0666 minus the umask."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_atomic(path, data, mode=None):
+    """
+    Durably replaces path with data (bytes).
+
+    The data goes to a uniquely named temp file in the same directory, which is
+    fsynced and then renamed over path, so a crash never leaves a partially
+    written file and concurrent writers never share a temp file. The result gets
+    permissions mode, or by default keeps path's current permissions (0666
+    minus the umask for a new file).
+    """
+    if mode is None:
+        mode = _default_mode(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cached_get(url, headers=None, timeout=30):
+    """
+    Fetches url and returns the response body as bytes.
+
+    Sends If-None-Match / If-Modified-Since from the previous response and
+    serves the cached body when the server answers 304 Not Modified.
+    Raises requests.RequestException on network or HTTP errors.
+    """
+    body_path, meta_path = _cache_paths(url)
+    request_headers = dict(headers or {})
+
+    meta = _read_meta(meta_path) if os.path.exists(body_path) else {}
+    if meta.get("etag"):
+        request_headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        request_headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = _SESSION.get(url, headers=request_headers, timeout=timeout)
+    if response.status_code == 304:
+        try:
+            with open(body_path, "rb") as f:
+                return f.read()
+        except OSError:
+            # Cache vanished between the check and the read; fetch unconditionally.
+            response = _SESSION.get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+
+    content = response.content
+    try:
+        # The feed is a private itinerary: keep the cache readable by its owner only.
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        os.chmod(CACHE_DIR, 0o700)
+        write_atomic(body_path, content, mode=0o600)
+        write_atomic(meta_path, json.dumps({
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }).encode("utf-8"), mode=0o600)
+    except OSError:
+        # The cache is an optimization only; never fail the run because of it.
+        pass
+    return content
+
+
+def drop_cached(url):
+    """Removes the cache entry for url, e.g. after its body failed to parse."""
+    for path in _cache_paths(url):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass